@@ -11,11 +11,16 @@
 
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
-from future.builtins import str
+from future.builtins import range, str
+
+import hashlib
+import multiprocessing
+import pickle
+import sys
 
 import numpy as np
 
-from . import metrics
+from . import klib, metrics
 
 
 class ProfileDistance(object):
@@ -123,6 +128,84 @@ class ProfileDistance(object):
         """
         self._dynamic_smooth(left, right, 0, left.number)
 
+    def _preprocess(self, profile):
+        """
+        Prepare a profile for distance calculations. Only the operations that
+        do not depend on the other profile are done here, so the result can
+        be reused when comparing the profile to several other profiles.
+
+        :arg kpal.klib.Profile profile: Profile to prepare.
+
+        :return: The prepared profile. This can be `profile` itself if there
+          is nothing to prepare, so it should not be modified.
+        :rtype: kpal.klib.Profile
+        """
+        if self._do_balance:
+            profile = profile.copy()
+            profile.balance()
+        return profile
+
+    def _distance(self, left, right, scale=None):
+        """
+        Calculate the distance between two prepared *k*-mer profiles.
+
+        :arg kpal.klib.Profile left, right: Profiles to calculate distance
+          between, prepared by :meth:`_preprocess`. They are not modified.
+        :arg scale: Optional precomputed scaling factors for `left` and
+          `right`. Only valid if `do_positive` is not set.
+        :type scale: tuple(float, float)
+
+        :return: The distance between `left` and `right`.
+        :rtype: float
+        """
+        if (self._do_positive and not self._do_smooth and
+                not self._distance_function):
+            # Only positions that are non-zero in both profiles contribute to
+            # the multiset distance, so we calculate it on those only.
+            positive = np.flatnonzero(np.logical_and(left.counts,
+                                                     right.counts))
+            if self._do_scale and not positive.size:
+                # Without shared non-zero positions, both totals used for
+                # scaling are 0 and the scaled distance is undefined.
+                return np.nan
+            left_counts = left.counts[positive]
+            right_counts = right.counts[positive]
+        else:
+            if self._do_positive or self._do_smooth:
+                left = left.copy()
+                right = right.copy()
+
+            if self._do_positive:
+                left.counts = metrics.positive(left.counts, right.counts)
+                right.counts = metrics.positive(right.counts, left.counts)
+
+            if self._do_smooth:
+                self.dynamic_smooth(left, right)
+
+            left_counts = left.counts
+            right_counts = right.counts
+
+        if self._do_scale:
+            if scale is None:
+                left_scale, right_scale = metrics.get_scale_from_totals(
+                    left_counts.sum(), right_counts.sum())
+                if self._down:
+                    left_scale, right_scale = metrics.scale_down(left_scale,
+                                                                 right_scale)
+            else:
+                left_scale, right_scale = scale
+
+            # Unless we scale down, one of the factors is always 1, so we can
+            # skip a pass over the counts (and work with integer counts).
+            if left_scale != 1:
+                left_counts = left_counts * left_scale
+            if right_scale != 1:
+                right_counts = right_counts * right_scale
+
+        if not self._distance_function:
+            return metrics.multiset(left_counts, right_counts, self._pairwise)
+        return self._distance_function(left_counts, right_counts)
+
     def distance(self, left, right):
         """
         Calculate the distance between two *k*-mer profiles.
@@ -133,35 +216,276 @@ class ProfileDistance(object):
         :return: The distance between `left` and `right`.
         :rtype: float
         """
-        left = left.copy()
-        right = right.copy()
+        return self._distance(self._preprocess(left), self._preprocess(right))
 
-        if self._do_balance:
-            left.balance()
-            right.balance()
 
-        if self._do_positive:
-            left.counts = metrics.positive(left.counts, right.counts)
-            right.counts = metrics.positive(right.counts, left.counts)
+#: Profiles, distance functions object, profile totals, and representatives
+#: shared with the worker processes of :func:`distance_matrix`.
+_worker_state = None
 
-        if self._do_smooth:
-            self.dynamic_smooth(left, right)
-        if self._do_scale:
-            left_scale, right_scale = metrics.get_scale(left.counts,
-                                                        right.counts)
 
-            if self._down:
-                left_scale, right_scale = metrics.scale_down(left_scale,
-                                                             right_scale)
-            left.counts = left.counts * left_scale
-            right.counts = right.counts * right_scale
+def _init_worker(profiles, dist, totals, representatives):
+    """
+    Initialise a worker process for :func:`distance_matrix`.
+    """
+    global _worker_state
+    _worker_state = profiles, dist, totals, representatives
 
-        if not self._distance_function:
-            return metrics.multiset(left.counts, right.counts, self._pairwise)
-        return self._distance_function(left.counts, right.counts)
+
+def _matrix_distance(profiles, dist, totals, i, j):
+    """
+    Calculate the distance between two prepared profiles in
+    :func:`distance_matrix`.
+
+    :arg list(Profile) profiles: List of prepared profiles.
+    :arg kpal.kdistlib.ProfileDistance dist: A distance functions object.
+    :arg totals: Optional precomputed totals of the profiles, used for
+      scaling.
+    :type totals: list(int)
+    :arg int i, j: Indices of the two profiles.
+
+    :return: The distance between the two profiles.
+    :rtype: float
+    """
+    scale = None
+    if totals is not None:
+        scale = metrics.get_scale_from_totals(totals[i], totals[j])
+        if dist._down:
+            scale = metrics.scale_down(*scale)
+    return dist._distance(profiles[i], profiles[j], scale)
+
+
+def _new_distances(profiles, dist, totals, representatives, i, start):
+    """
+    Calculate the distances in row `i` of the distance matrix that are not
+    known from earlier rows (see :func:`_row_tasks`).
+
+    :arg list(Profile) profiles: List of prepared profiles.
+    :arg kpal.kdistlib.ProfileDistance dist: A distance functions object.
+    :arg totals: Optional precomputed totals of the profiles, used for
+      scaling.
+    :type totals: list(int)
+    :arg list(int) representatives: For each profile, the index of its
+      representative.
+    :arg int i: Index of the row.
+    :arg int start: Index of the first profile to calculate the distance to.
+
+    :return: The distances between the representative of profile `i` and
+      the representatives `j` with `start <= j < i`, in that order.
+    :rtype: list(float)
+    """
+    left = representatives[i]
+    return [_matrix_distance(profiles, dist, totals, left, j)
+            for j in range(start, i) if representatives[j] == j]
+
+
+def _row_distances(task):
+    """
+    Calculate the new distances in a row of the distance matrix in a worker
+    process of :func:`distance_matrix`.
+
+    :arg task: Index of the row and of the first profile to calculate the
+      distance to.
+    :type task: tuple(int, int)
+
+    :return: The distances calculated by :func:`_new_distances`.
+    :rtype: list(float)
+    """
+    return _new_distances(*(_worker_state + task))
+
+
+def _pool(processes, initializer, initargs):
+    """
+    Create a pool of worker processes.
+
+    On Linux, the workers are forked so they inherit `initargs` instead of
+    receiving them pickled (custom distance functions are often lambdas,
+    which cannot be pickled). Other platforms do not fork by default (it is
+    unsafe on macOS, for example), so we use their default start method and
+    require `initargs` to be picklable.
+
+    :raise ValueError: If `initargs` cannot be pickled and the workers cannot
+      be forked.
+    """
+    if sys.platform.startswith('linux'):
+        try:
+            context = multiprocessing.get_context('fork')
+        except AttributeError:
+            context = multiprocessing
+    else:
+        context = multiprocessing
+        try:
+            pickle.dumps(initargs)
+        except (pickle.PicklingError, AttributeError, TypeError):
+            raise ValueError('custom functions can only be used with one job '
+                             'on this platform')
+    return context.Pool(processes, initializer, initargs)
+
+
+def _representatives(profiles):
+    """
+    Find a representative for each profile such that profiles with identical
+    counts have the same representative.
+
+    :arg list(Profile) profiles: List of profiles.
+
+    :return: For each profile, the index of its representative.
+    :rtype: list(int)
+    """
+    representatives = []
+    candidates = {}
+
+    for i, profile in enumerate(profiles):
+        digest = hashlib.sha1(profile.counts.tobytes()).digest()
+        for j in candidates.setdefault(digest, []):
+            if np.array_equal(profiles[j].counts, profile.counts):
+                representatives.append(j)
+                break
+        else:
+            candidates[digest].append(i)
+            representatives.append(i)
+
+    return representatives
+
+
+def _row_tasks(representatives):
+    """
+    Find the distances to calculate for each row of the distance matrix.
+
+    Row `i` contains the distances between the representative of profile `i`
+    and the representatives of all profiles before it. If profile `i` is a
+    duplicate, the distances to representatives before its previous
+    occurrence were already calculated for that row, so we only need the
+    distances to representatives from its previous occurrence on.
+
+    :arg list(int) representatives: For each profile, the index of its
+      representative.
+
+    :return: For each row of the distance matrix (starting at 1), the index
+      of the row and of the first profile to calculate the distance to.
+    :rtype: list(tuple(int, int))
+    """
+    tasks = []
+    previous = {}
+
+    for i, representative in enumerate(representatives):
+        if i:
+            tasks.append((i, previous.get(representative, 0)))
+        previous[representative] = i
+
+    return tasks
+
+
+def _pairwise_rows(representatives, tasks, new_distances):
+    """
+    Assemble the rows of the distance matrix from the distances calculated
+    for each row. Distances from a profile that has duplicates are kept
+    until the row of its last duplicate.
+
+    :arg list(int) representatives: For each profile, the index of its
+      representative.
+    :arg tasks: The tasks found by :func:`_row_tasks`.
+    :type tasks: list(tuple(int, int))
+    :arg new_distances: For each task, the distances calculated by
+      :func:`_new_distances`.
+    :type new_distances: iterator(list(float))
+
+    :return: A generator yielding the distances in each row of the distance
+      matrix.
+    :rtype: iterator(list(float))
+    """
+    last = dict((representative, i)
+                for i, representative in enumerate(representatives))
+    known_distances = {}
+
+    for (i, start), distances in zip(tasks, new_distances):
+        left = representatives[i]
+        known = known_distances.pop(left, {})
+        known.update(zip((j for j in range(start, i)
+                          if representatives[j] == j), distances))
+        if last[left] > i:
+            known_distances[left] = known
+
+        yield [known[representatives[j]] for j in range(i)]
+
+
+def _vector_counts(profiles, dist):
+    """
+    Get the counts of all profiles as one floating point matrix, for
+    calculating Euclidean distances or Cosine similarities from the dot
+    products of the profiles (see :func:`_vector_rows`).
+
+    This is only done if the result is exactly the same as calculating the
+    distances pairwise, which is the case without positive, smoothing, and
+    scaling options and if all sums of products of counts can be represented
+    exactly by floating point numbers.
+
+    :arg list(Profile) profiles: List of prepared profiles.
+    :arg kpal.kdistlib.ProfileDistance dist: A distance functions object.
+
+    :return: Matrix with the counts of each profile as a row, or `None` if
+      the distances cannot be calculated this way.
+    :rtype: numpy.ndarray
+    """
+    if (dist._distance_function not in (metrics.euclidean,
+                                        metrics.cosine_similarity) or
+            dist._do_positive or dist._do_smooth or dist._do_scale):
+        return None
+
+    if not profiles or any(profile.counts.dtype.kind not in 'iu'
+                           for profile in profiles):
+        return None
+
+    number = profiles[0].number
+    maximum = max(float(np.abs(profile.counts).max()) for profile in profiles)
+    if 4 * maximum ** 2 * number >= 2 ** 53:
+        return None
+
+    # Fill the matrix one profile at a time, so we do not hold another copy
+    # of all counts.
+    counts = np.empty((len(profiles), number), dtype='float64')
+    for row, profile in zip(counts, profiles):
+        row[:] = profile.counts
+
+    return counts
+
+
+def _vector_rows(counts, distance_function):
+    """
+    Calculate the Euclidean distances or Cosine similarities in each row of
+    the distance matrix from the dot products of the profiles. The dot
+    products are calculated for blocks of rows at once.
+
+    :arg numpy.ndarray counts: Counts of all profiles, as returned by
+      :func:`_vector_counts`.
+    :arg function distance_function: Either :func:`metrics.euclidean` or
+      :func:`metrics.cosine_similarity`.
+
+    :return: A generator yielding the distances in each row of the distance
+      matrix.
+    :rtype: iterator(numpy.ndarray)
+    """
+    squares = np.einsum('ij,ij->i', counts, counts)
+    lengths = np.sqrt(squares)
+
+    for rows in klib._row_blocks(len(counts), len(counts)):
+        start = rows.start
+        end = min(rows.stop, len(counts))
+        products = np.dot(counts[rows], counts[:end - 1].T)
+
+        if distance_function is metrics.euclidean:
+            distances = np.sqrt(squares[rows, np.newaxis] +
+                                squares[np.newaxis, :end - 1] - 2 * products)
+        else:
+            distances = products / (lengths[rows, np.newaxis] *
+                                    lengths[np.newaxis, :end - 1])
+
+        # The first row of the distance matrix is empty.
+        for i in range(max(start, 1), end):
+            yield distances[i - start, :i]
 
 
-def distance_matrix(profiles, output, precision, dist):
+def distance_matrix(profiles, output, precision, dist, jobs=1):
     """
     Make a distance matrix for any number of *k*-mer profiles.
 
@@ -170,17 +494,57 @@ def distance_matrix(profiles, output, precision, dist):
     :type output: file-like object
     :arg int precision: Number of digits in the output.
     :arg kpal.kdistlib.ProfileDistance dist: A distance functions object.
+    :arg int jobs: Number of processes to calculate the distances with.
     """
     input_count = len(profiles)
 
-    print(str(input_count), file=output)
-    for i in profiles:
-        print(i.name, file=output)
-    for i in range(1, input_count):
-        for j in range(i):
-            if (j):
-                output.write(' ')
-            output.write('{{0:.{0}f}}'.format(precision).format(
-                         dist.distance(profiles[i], profiles[j])))
-
-        output.write('\n')
+    # Prepare every profile once instead of once for every pair. The totals
+    # do not change after preparation (smoothing preserves them), unless we
+    # only use positive values, so we can calculate them once for scaling.
+    profiles = [dist._preprocess(profile) for profile in profiles]
+    if dist._do_scale and not dist._do_positive:
+        totals = [profile.total for profile in profiles]
+    else:
+        totals = None
+
+    output.write('\n'.join([str(input_count)] +
+                            [str(profile.name) for profile in profiles]) +
+                 '\n')
+
+    pool = None
+    try:
+        vector_counts = _vector_counts(profiles, dist)
+
+        if vector_counts is not None:
+            rows = _vector_rows(vector_counts, dist._distance_function)
+        else:
+            # Profiles with identical counts have identical distances to any
+            # other profile, so we only calculate distances between
+            # representatives. Note that the distance between two identical
+            # profiles is not necessarily 0.
+            representatives = _representatives(profiles)
+            tasks = _row_tasks(representatives)
+
+            if jobs > 1 and len(tasks) > 1:
+                # The results are yielded in order, so the matrix is still
+                # written one row at a time.
+                pool = _pool(jobs, _init_worker,
+                             (profiles, dist, totals, representatives))
+                new_distances = pool.imap(_row_distances, tasks)
+            else:
+                new_distances = (
+                    _new_distances(profiles, dist, totals, representatives,
+                                   *task)
+                    for task in tasks)
+
+            rows = _pairwise_rows(representatives, tasks, new_distances)
+
+        template = '{{0:.{0}f}}'.format(precision)
+        for row in rows:
+            output.write(' '.join(template.format(distance)
+                                  for distance in row) + '\n')
+    finally:
+        if pool is not None:
+            # All tasks are done unless writing the matrix failed.
+            pool.terminate()
+            pool.join()
@@ -17,12 +17,120 @@ import itertools
 import math
 import re
 
-from Bio import SeqIO
+from Bio.SeqIO.FastaIO import SimpleFastaParser
 import numpy as np
 
+try:
+    import numba
+except ImportError:
+    numba = None
+
 from . import metrics
 
 
+#: Number of *k*-mers to encode at once when counting.
+_BLOCK_SIZE = 2 ** 20
+
+#: Maximum number of encoded *k*-mers to collect before counting them.
+_BATCH_SIZE = 2 ** 24
+
+#: Number of elements to calculate at once when filling a matrix.
+_MATRIX_BLOCK_SIZE = 2 ** 20
+
+
+def _join_sequences(sequences, size):
+    """
+    Join sequences to strings of at least `size` characters (except for the
+    last one). The sequences are separated by a non-nucleotide character, so
+    no *k*-mer spans two sequences.
+
+    :arg sequences: An iterable of string sequences.
+    :type sequences: iterator(str)
+    :arg int size: Minimum size of the joined strings.
+
+    :return: A generator yielding the joined strings.
+    :rtype: iterator(str)
+    """
+    batch = []
+    batch_size = 0
+
+    for sequence in sequences:
+        batch.append(sequence)
+        batch_size += len(sequence) + 1
+        if batch_size >= size:
+            yield ' '.join(batch)
+            batch = []
+            batch_size = 0
+
+    if batch:
+        yield ' '.join(batch)
+
+
+def _row_blocks(rows, columns):
+    """
+    Divide the rows of a matrix in blocks of at most `_MATRIX_BLOCK_SIZE`
+    elements (but at least one row), so the matrix can be filled one block at
+    a time with small temporary arrays.
+
+    :arg int rows, columns: Dimensions of the matrix.
+
+    :return: A generator yielding a slice of rows for each block.
+    :rtype: iterator(slice)
+    """
+    size = max(1, _MATRIX_BLOCK_SIZE // columns)
+    for start in range(0, rows, size):
+        yield slice(start, start + size)
+
+
+def _ascii_lookup(table):
+    """
+    Create a lookup table from ASCII codes to binary nucleotides. Characters
+    that are not nucleotides map to 0x04.
+
+    :arg dict table: Conversion table from nucleotide to binary.
+
+    :return: Array with the binary nucleotide for each ASCII code.
+    :rtype: numpy.ndarray
+    """
+    lookup = np.empty(256, dtype='uint8')
+    lookup.fill(0x04)
+    for nucleotide, binary in table.items():
+        lookup[ord(nucleotide)] = binary
+    return lookup
+
+
+if numba is not None:
+    try:
+        @numba.njit(cache=True)
+        def _count_kmers(nucleotides, length, counts):
+            """
+            Count all *k*-mers in an array of binary nucleotides in a single
+            pass, skipping *k*-mers with non-nucleotides (0x04).
+
+            :arg numpy.ndarray nucleotides: Binary nucleotides.
+            :arg int length: Length of the *k*-mers.
+            :arg numpy.ndarray counts: Counts to increment.
+            """
+            mask = (1 << 2 * length) - 1
+            binary = 0
+            run = 0
+            for i in range(nucleotides.shape[0]):
+                nucleotide = nucleotides[i]
+                if nucleotide == 0x04:
+                    run = 0
+                    continue
+                binary = ((binary << 2) | nucleotide) & mask
+                run += 1
+                if run >= length:
+                    counts[binary] += 1
+    except RuntimeError:
+        # Numba cannot cache compiled functions if it finds no writable
+        # cache directory, in which case we count with NumPy.
+        _count_kmers = None
+else:
+    _count_kmers = None
+
+
 class Profile(object):
     """
     A *k*-mer profile provides *k*-mer counts and operations on them.
@@ -47,6 +155,17 @@ class Profile(object):
         'T': 0x03, 't': 0x03
     }
 
+    #: Translation table from nucleotide to base 4 digit.
+    _nucleotide_to_digit = dict((ord(nucleotide), '0123'[binary])
+                                for nucleotide, binary
+                                in _nucleotide_to_binary.items())
+
+    #: Lookup table from ASCII code to binary (0x04 for non-nucleotides).
+    _ascii_to_binary = _ascii_lookup(_nucleotide_to_binary)
+
+    #: Pattern matching DNA strings.
+    _dna = re.compile(r'[ACGTacgt]*\Z')
+
     #: Conversion table form binary to nucleotide.
     _binary_to_nucleotide = {
         0x00: 'A',
@@ -61,19 +180,27 @@ class Profile(object):
         self.name = name
 
     @classmethod
-    def from_file(cls, handle, name=None):
+    def from_file(cls, handle, name=None, out=None):
         """
         Load the *k*-mer profile from a file.
 
         :arg h5py.File handle: Open readable *k*-mer profile file handle.
         :arg str name: Profile name.
+        :arg numpy.ndarray out: Optional preallocated array of the right
+          length to read the counts into. It is used as the profile counts.
 
         :return: A *k*-mer profile.
         :rtype: Profile
         """
         name = name or sorted(handle['profiles'].keys())[0]
-        counts = handle['profiles/' + name][:]
-        return cls(counts, name=name)
+        dataset = handle['profiles/' + name]
+
+        # Counts may be stored with a smaller integer type, but we always
+        # work with 64-bit integers in memory.
+        if out is None:
+            out = np.empty(dataset.shape, dtype='int64')
+        dataset.read_direct(out)
+        return cls(out, name=name)
 
     @classmethod
     def from_file_old_format(cls, handle, name=None):
@@ -87,11 +214,18 @@ class Profile(object):
         :return: A *k*-mer profile.
         :rtype: Profile
         """
-        # Ignore lines with length, total, nonzero.
-        for _ in range(3):
+        # Ignore lines with total, nonzero.
+        length = int(next(handle))
+        for _ in range(2):
             next(handle)
 
-        counts = np.loadtxt(handle, dtype='int64')
+        # Parsing the rest of the file in one call is much faster than
+        # `numpy.loadtxt`, but older NumPy versions silently stop at the first
+        # invalid value.
+        counts = np.fromstring(handle.read(), dtype='int64', sep=' ')
+        if len(counts) != 4 ** length:
+            raise ValueError('Invalid profile file (old format).')
+
         return cls(counts, name=name)
 
     @classmethod
@@ -108,7 +242,25 @@ class Profile(object):
         :return: A *k*-mer profile.
         :rtype: Profile
         """
-        sequences = (str(record.seq) for record in SeqIO.parse(handle, 'fasta'))
+        sequences = (sequence for _, sequence in SimpleFastaParser(handle))
+        return cls.from_sequences(sequences, length, name=name)
+
+    @classmethod
+    def from_fasta_files(cls, handles, length, name=None):
+        """
+        Create one *k*-mer profile from several FASTA files by counting all
+        *k*-mers in each line of each file.
+
+        :arg handles: Open readable FASTA file handles.
+        :type handles: list(file-like object)
+        :arg int length: Length of the *k*-mers.
+        :arg str name: Profile name.
+
+        :return: A *k*-mer profile.
+        :rtype: Profile
+        """
+        sequences = (sequence for handle in handles
+                     for _, sequence in SimpleFastaParser(handle))
         return cls.from_sequences(sequences, length, name=name)
 
     @classmethod
@@ -128,9 +280,12 @@ class Profile(object):
         """
         prefix = prefix + '_' if prefix else ''
 
-        for i, record in enumerate(SeqIO.parse(handle, 'fasta')):
-            name = prefix + (record.name or str(i + 1))
-            yield cls.from_sequences([str(record.seq)], length, name=name)
+        for i, (title, sequence) in enumerate(SimpleFastaParser(handle)):
+            # Like Biopython, we use the first word of the title as record
+            # name.
+            record_name = title.split(None, 1)[0] if title.strip() else ''
+            name = prefix + (record_name or str(i + 1))
+            yield cls.from_sequences([sequence], length, name=name)
 
     @classmethod
     def from_sequences(cls, sequences, length, name=None):
@@ -147,27 +302,101 @@ class Profile(object):
         :rtype: Profile
         """
         number = 4 ** length
-        bitmask = number - 0x01
-        counts = [0] * number
-        alphabet = re.compile('[^' + ''.join(cls._nucleotide_to_binary) + ']')
-
-        for sequence in sequences:
-            for part in alphabet.split(sequence):
-                if len(part) >= length:
-                    binary = 0x00
-
-                    # Calculate the binary representation of a k-mer.
-                    for i in part[:length]:
-                        binary = (binary << 2) | cls._nucleotide_to_binary[i]
-                    counts[binary] += 1
+        counts = np.zeros(number, dtype='int64')
+
+        if _count_kmers is not None:
+            for sequence in _join_sequences(sequences, _BLOCK_SIZE):
+                _count_kmers(cls._nucleotides(sequence), length, counts)
+            return cls(counts, name=name)
+
+        # Encoding a sequence has some overhead and counting a batch of
+        # k-mers costs a pass over all counts, so for many short sequences we
+        # encode several sequences at once and collect their k-mers before
+        # counting them.
+        batch = []
+        batch_size = 0
+
+        for sequence in _join_sequences(sequences, _BLOCK_SIZE):
+            for binaries in cls._encode(sequence, length):
+                batch.append(binaries)
+                batch_size += len(binaries)
+                if batch_size >= min(number, _BATCH_SIZE):
+                    counts += np.bincount(np.concatenate(batch),
+                                          minlength=number)
+                    batch = []
+                    batch_size = 0
+
+        if batch:
+            counts += np.bincount(np.concatenate(batch), minlength=number)
+
+        return cls(counts, name=name)
+
+    @classmethod
+    def _nucleotides(cls, sequence):
+        """
+        Convert a sequence to an array of binary nucleotides, with 0x04 for
+        non-nucleotide characters.
 
-                    # Calculate the binary representation of the next k-mer.
-                    for i in part[length:]:
-                        binary = ((binary << 2) |
-                                  cls._nucleotide_to_binary[i]) & bitmask
-                        counts[binary] += 1
+        :arg str sequence: A sequence.
 
-        return cls(np.array(counts, dtype='int64'), name=name)
+        :return: Binary nucleotides.
+        :rtype: numpy.ndarray
+        """
+        # Non-ASCII characters are replaced by one byte each, so positions
+        # are preserved.
+        return cls._ascii_to_binary[np.frombuffer(
+            sequence.encode('ascii', 'replace'), dtype='uint8')]
+
+    @classmethod
+    def _encode(cls, sequence, length):
+        """
+        Calculate the binary representations of all *k*-mers in `sequence`,
+        skipping *k*-mers with non-nucleotide characters.
+
+        :arg str sequence: A sequence.
+        :arg int length: Length of the *k*-mers.
+
+        :return: A generator yielding arrays of binary representations of
+          consecutive blocks of *k*-mers.
+        :rtype: iterator(numpy.ndarray)
+        """
+        nucleotides = cls._nucleotides(sequence)
+
+        for start in range(0, len(nucleotides) - length + 1, _BLOCK_SIZE):
+            block = nucleotides[start:start + _BLOCK_SIZE + length - 1]
+            size = len(block) - length + 1
+
+            # A k-mer is valid if the number of non-nucleotides before its
+            # end equals the number before its start.
+            invalid = np.concatenate(([0], np.cumsum(block == 0x04)))
+            valid = invalid[length:] == invalid[:size]
+
+            # The binary representations of k-mers are combined from those of
+            # shorter words, doubling the word length in each step, so we
+            # need about log(k) instead of k passes over the block.
+            binaries = None
+            binaries_length = 0
+            words = (block & 0x03).astype('int64')
+            words_length = 1
+
+            while True:
+                if length & words_length:
+                    if binaries is None:
+                        binaries = words
+                    else:
+                        count = len(block) - binaries_length - words_length + 1
+                        binaries = ((binaries[:count] << 2 * words_length) |
+                                    words[binaries_length:
+                                          binaries_length + count])
+                    binaries_length += words_length
+                if 2 * words_length > length:
+                    break
+                count = len(block) - 2 * words_length + 1
+                words = ((words[:count] << 2 * words_length) |
+                         words[words_length:words_length + count])
+                words_length *= 2
+
+            yield binaries[valid]
 
     @property
     def name(self):
@@ -243,8 +472,16 @@ class Profile(object):
         name = name or self.name or next(str(n) for n in itertools.count(1)
                                          if str(n) not in handle['profiles'])
 
+        # Store the counts as 32-bit integers if they fit, which halves the
+        # amount of data to compress, write, and read back.
+        dtype = 'int64'
+        int32 = np.iinfo('int32')
+        if (self.counts.size and self.counts.min() >= int32.min and
+                self.counts.max() <= int32.max):
+            dtype = 'int32'
+
         profile = handle.create_dataset('profiles/' + name, data=self.counts,
-                                        dtype='int64', compression='gzip')
+                                        dtype=dtype, compression='gzip')
         profile.attrs['length'] = self.length
         profile.attrs['total'] = self.total
         profile.attrs['non_zero'] = self.non_zero
@@ -287,15 +524,19 @@ class Profile(object):
         Add the counts of the reverse complement of a *k*-mer to the *k*-mer
         and vice versa.
         """
-        for i in range(self.number):
-            i_rc = self.reverse_complement(i)
+        # Palindromes are their own reverse complement, so their counts are
+        # doubled.
+        self.counts += self.counts[self._reverse_complements()]
 
-            if i < i_rc:
-                temp = self.counts[i]
-                self.counts[i] += self.counts[i_rc]
-                self.counts[i_rc] += temp
-            elif i == i_rc:
-                self.counts[i] += self.counts[i]
+    def _reverse_complements(self):
+        """
+        Calculate the reverse complements of all *k*-mers.
+
+        :return: Binary representations of the reverse complements of all
+          *k*-mers in binary order.
+        :rtype: numpy.ndarray
+        """
+        return self.reverse_complement(np.arange(self.number, dtype='int64'))
 
     def split(self):
         """
@@ -311,20 +552,17 @@ class Profile(object):
         :return: The doubled forward and reverse complement counts.
         :rtype: numpy.ndarray, numpy.ndarray
         """
-        forward = []
-        reverse = []
+        reverse_complements = self._reverse_complements()
 
-        for i in range(self.number):
-            i_rc = self.reverse_complement(i)
+        # Every pair of a k-mer and its reverse complement is taken once, at
+        # the smallest of the two. Palindromes are not doubled, since they
+        # are in both lists.
+        forward = np.flatnonzero(
+            np.arange(self.number) <= reverse_complements)
+        reverse = reverse_complements[forward]
+        factors = np.where(forward < reverse, 2, 1)
 
-            if i < i_rc:
-                forward.append(self.counts[i] * 2)
-                reverse.append(self.counts[i_rc] * 2)
-            elif i == i_rc:
-                forward.append(self.counts[i])
-                reverse.append(self.counts[i])
-
-        return np.array(forward), np.array(reverse)
+        return self.counts[forward] * factors, self.counts[reverse] * factors
 
     def shrink(self, factor=1):
         """
@@ -339,16 +577,10 @@ class Profile(object):
             raise ValueError(
                 "Reduction factor should be smaller than k-mer size.")
 
-        # I don't know how to do this operation directly with NumPy
-        # instructions without creating a complete copy of the counts in
-        # memory (e.g., using `np.split(self.counts, ...)`).
-        # So instead we just build the new counts one at a time. Note that
-        # the builtin Python `sum` is actually faster than `np.sum` here,
-        # since the arrays are very small.
-        merge_size = 4 ** factor
-        new_counts = (sum(self.counts[i:i + merge_size])
-                      for i in range(0, self.number, merge_size))
-        self.counts = np.fromiter(new_counts, dtype='int64')
+        # All k-mers sharing a prefix of length k - factor are adjacent in the
+        # counts, so grouping them by reshaping is just a view and the sums
+        # are done in one pass.
+        self.counts = self.counts.reshape(-1, 4 ** factor).sum(axis=1)
         self.length -= factor
 
     def shuffle(self):
@@ -366,13 +598,12 @@ class Profile(object):
         :return: Binary representation of `sequence`.
         :rtype: int
         """
-        result = 0x00
-
-        for i in sequence:
-            result <<= 2
-            result |= self._nucleotide_to_binary[i]
+        # Two bits per nucleotide is just a base 4 number, which we can let
+        # `int` parse instead of shifting in every nucleotide ourselves.
+        if not self._dna.match(sequence):
+            raise KeyError('not a valid DNA sequence: %s' % sequence)
 
-        return result
+        return int(sequence.translate(self._nucleotide_to_digit) or '0', 4)
 
     def binary_to_dna(self, number):
         """
@@ -384,9 +615,10 @@ class Profile(object):
         :rtype: str
         """
         sequence = ""
+        binary_to_nucleotide = self._binary_to_nucleotide
 
         for i in range(self.length):
-            sequence += self._binary_to_nucleotide[number & 0x03]
+            sequence += binary_to_nucleotide[number & 0x03]
             number >>= 2
 
         return sequence[::-1]
@@ -396,20 +628,36 @@ class Profile(object):
         Calculate the reverse complement of a DNA sequence in a binary
         representation.
 
-        :arg int number: Binary representation of a DNA sequence.
+        :arg number: Binary representation of a DNA sequence, or an array of
+          them.
+        :type number: int or numpy.ndarray
 
         :return: Binary representation of the reverse complement of the
           sequence corresponding to `number`.
-        :rtype: int
-        """
-        number = ~number
-        result = 0x00
-
-        for i in range(self.length):
-            result = (result << 2) | (number & 0x03)
-            number >>= 2
-
-        return result
+        :rtype: int or numpy.ndarray
+        """
+        # The complement is a bitwise negation of the 2k bits, after which
+        # we reverse the order of the 2-bit nucleotides in a 64-bit word by
+        # swapping ever larger groups of them, and shift the result back to
+        # the lower 2k bits.
+        if isinstance(number, np.ndarray):
+            # Shifts on signed integers would drag the sign bit along.
+            x = number.astype('uint64')
+        else:
+            x = int(number)
+
+        x ^= (1 << (2 * self.length)) - 1
+        x = ((x & 0x3333333333333333) << 2) | ((x >> 2) & 0x3333333333333333)
+        x = ((x & 0x0F0F0F0F0F0F0F0F) << 4) | ((x >> 4) & 0x0F0F0F0F0F0F0F0F)
+        x = ((x & 0x00FF00FF00FF00FF) << 8) | ((x >> 8) & 0x00FF00FF00FF00FF)
+        x = (((x & 0x0000FFFF0000FFFF) << 16) |
+             ((x >> 16) & 0x0000FFFF0000FFFF))
+        x = ((x & 0x00000000FFFFFFFF) << 32) | (x >> 32)
+        x >>= 64 - 2 * self.length
+
+        if isinstance(number, np.ndarray):
+            return x.astype(number.dtype)
+        return x
 
     def _ratios_matrix(self):
         """
@@ -417,23 +665,20 @@ class Profile(object):
         occurs, the frequency will be set to -1.0.
 
         :return: A matrix with relative frequencies.
-        :rtype: float[][]
+        :rtype: numpy.ndarray
         """
         # Perhaps we can use something like this for a future normalization
         # operation.
-        # Todo: Do this directly with NumPy.
-        ratios = []
-        for i in range(self.number):
-            ratios.append(self.number * [0.0])
+        number = self.number
+        counts = self.counts
+        total = self.total
+        nonzero = counts != 0
+        divisors = np.where(nonzero, counts, 1)
 
-        # Fill the matrix.
-        for i in range(self.number):
-            for j in range(self.number):
-                if self.counts[j]:
-                    ratios[i][j] = (self.counts[i] /
-                                    self.counts[j]) / self.total
-                else:
-                    ratios[i][j] = -1.0
+        ratios = np.empty((number, number))
+        for rows in _row_blocks(number, number):
+            quotients = counts[rows, np.newaxis] / divisors
+            ratios[rows] = np.where(nonzero, quotients / total, -1.0)
 
         return ratios
 
@@ -442,18 +687,17 @@ class Profile(object):
         Calculate all frequency differences of *k*-mers.
 
         :return: A matrix with frequency differences.
-        :rtype: float[][]
+        :rtype: numpy.ndarray
         """
-        ratios = []
-        for i in range(self.number):
-            ratios.append(self.number * [0])
+        number = self.number
+        counts = self.counts
+        total = self.total
+        nonzero = counts != 0
 
-        # Fill the matrix.
-        for i in range(self.number):
-            for j in range(self.number):
-                if self.counts[j]:
-                    ratios[i][j] = abs(self.counts[i] -
-                                       self.counts[j]) / self.total
+        ratios = np.empty((number, number))
+        for rows in _row_blocks(number, number):
+            differences = np.abs(counts[rows, np.newaxis] - counts)
+            ratios[rows] = np.where(nonzero, differences / total, 0.0)
 
         return ratios
 
@@ -461,8 +705,11 @@ class Profile(object):
         """
         Print the *k*-mer counts.
         """
-        for i in range(self.number):
-            print(self.binary_to_dna(i), self.counts[i])
+        # All k-mers in binary order are just the product of nucleotides.
+        kmers = (''.join(kmer) for kmer in
+                 itertools.product('ACGT', repeat=self.length))
+        print('\n'.join('{0} {1}'.format(kmer, count) for kmer, count
+                         in zip(kmers, self.counts.tolist())))
 
     def _print_ratios(self, ratios):
         """
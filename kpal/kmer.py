@@ -33,6 +33,13 @@ PAIRED_NAMES_COUNT_ERROR = ('number of left and right profile names do not '
 PREFIX_COUNT_ERROR = ('number of name prefixes does not match number of '
                       'profiles')
 
+# Profile statistics stored as attributes on profile datasets.
+_STATISTICS = ('length', 'total', 'non_zero', 'mean', 'median', 'std')
+
+# Buffer size for reading input files (FASTA or old format profiles), which
+# are read sequentially in large chunks anyway.
+_INPUT_BUFFER_SIZE = 2 ** 20
+
 
 # Importable definition, e.g. `package.module.merge_function`.
 # http://docs.python.org/2/reference/lexical_analysis.html#identifiers
@@ -109,7 +116,8 @@ def cat(input_handles, output_handle, names=None, prefixes=None):
             profile.save(output_handle, name=prefix + name)
 
 
-def count(input_handles, output_handle, size, names=None, by_record=False):
+def count(input_handles, output_handle, size, names=None, by_record=False,
+          merge=False):
     """
     Make k-mer profiles from FASTA files.
 
@@ -128,7 +136,20 @@ def count(input_handles, output_handle, size, names=None, by_record=False):
       instead of a k-mer profile per FASTA file. Profiles are named by the
       record names and prefixed according to `names` if more than one FASTA
       file is given).
+    :arg bool merge: If `True`, make one k-mer profile from all FASTA files
+      instead of a k-mer profile per FASTA file. Only one name can be given in
+      `names` (default: numbered 1).
     """
+    if merge:
+        if by_record:
+            raise ValueError('cannot count by record and merge FASTA files')
+        if names and len(names) != 1:
+            raise ValueError(NAMES_COUNT_ERROR)
+        profile = klib.Profile.from_fasta_files(
+            input_handles, size, name=names[0] if names else None)
+        profile.save(output_handle)
+        return
+
     names = names or [_name_from_handle(h) for h in input_handles]
 
     if len(names) != len(input_handles):
@@ -314,25 +335,35 @@ def info(input_handle, output_handle, names=None):
     print('Produced by:', input_handle.attrs['producer'], file=output_handle)
 
     for name in names:
-        # Todo: This loads the entire profile, which we actually do not need.
-        #   Especially for files with many profiles, we might want to just
-        #   get the statistics without loading the profile.
-        profile = klib.Profile.from_file(input_handle, name=name)
+        # The statistics are stored as dataset attributes, so we only need to
+        # load the profile if some of them are missing.
+        attributes = input_handle['profiles/' + name].attrs
+        if all(attribute in attributes for attribute in _STATISTICS):
+            statistics = dict((attribute, attributes[attribute])
+                              for attribute in _STATISTICS)
+            number = len(input_handle['profiles/' + name])
+        else:
+            profile = klib.Profile.from_file(input_handle, name=name)
+            statistics = dict((attribute, getattr(profile, attribute))
+                              for attribute in _STATISTICS)
+            number = profile.number
 
         print('', file=output_handle)
-        print('Profile:', profile.name, file=output_handle)
-        print('- k-mer length:', str(profile.length),
-              '({0} k-mers)'.format(profile.number), file=output_handle)
-        print('- Zero counts:', str(profile.number - profile.non_zero),
+        print('Profile:', name, file=output_handle)
+        print('- k-mer length:', str(statistics['length']),
+              '({0} k-mers)'.format(number), file=output_handle)
+        print('- Zero counts:', str(number - statistics['non_zero']),
               file=output_handle)
-        print('- Non-zero counts:', str(profile.non_zero), file=output_handle)
-        print('- Sum of counts:', str(profile.total), file=output_handle)
-        print('- Mean of counts:', '{0:.3f}'.format(profile.mean),
+        print('- Non-zero counts:', str(statistics['non_zero']),
               file=output_handle)
-        print('- Median of counts:', '{0:.3f}'.format(profile.median),
+        print('- Sum of counts:', str(statistics['total']),
+              file=output_handle)
+        print('- Mean of counts:', '{0:.3f}'.format(statistics['mean']),
+              file=output_handle)
+        print('- Median of counts:', '{0:.3f}'.format(statistics['median']),
               file=output_handle)
         print('- Standard deviation of counts:',
-              '{0:.3f}'.format(profile.std), file=output_handle)
+              '{0:.3f}'.format(statistics['std']), file=output_handle)
 
 
 def get_count(input_handle, output_handle, word, names=None):
@@ -625,7 +656,7 @@ def distance_matrix(input_handle, output_handle, names=None,
                     custom_pairwise=None, do_smooth=False, summary='min',
                     custom_summary=None, threshold=0, do_scale=False,
                     down=False, do_positive=False, do_balance=False,
-                    precision=10):
+                    precision=10, jobs=1):
     """
     Make a distance matrix between any number of k-mer profiles.
 
@@ -648,6 +679,7 @@ def distance_matrix(input_handle, output_handle, names=None,
     :arg bool do_positive: Only use positive values.
     :arg bool do_balance: Balance the profiles.
     :arg int precision: Number of digits in the output.
+    :arg int jobs: Number of processes to calculate the distances with.
     """
     names = names or sorted(input_handle['profiles'])
 
@@ -688,16 +720,19 @@ def distance_matrix(input_handle, output_handle, names=None,
 
     # Todo: This first creates all profiles in memory, which may be
     #   problematic for large k. We could provide an option to keep only the
-    #   two current profiles in memory. We may combine this with an option to
-    #   paralellize this function. The downside is that profiles have to be
-    #   read from file on each use.
-    counts = []
-    for name in names:
-        counts.append(klib.Profile.from_file(input_handle, name=name))
-        if counts[0].length != counts[-1].length:
-            raise ValueError(LENGTH_ERROR)
+    #   two current profiles in memory. The downside is that profiles have to
+    #   be read from file on each use.
+    shapes = set(input_handle['profiles/' + name].shape for name in names)
+    if len(shapes) > 1:
+        raise ValueError(LENGTH_ERROR)
+
+    # Read all profiles into the rows of one contiguous array.
+    rows = np.empty((len(names),) + shapes.pop(), dtype='int64')
+    counts = [klib.Profile.from_file(input_handle, name=name, out=row)
+              for name, row in zip(names, rows)]
 
-    kdistlib.distance_matrix(counts, output_handle, precision, dist)
+    kdistlib.distance_matrix(counts, output_handle, precision, dist,
+                             jobs=jobs)
 
 
 def main(args=None):
@@ -710,7 +745,8 @@ def main(args=None):
     """
     multi_input_parser = argparse.ArgumentParser(add_help=False)
     multi_input_parser.add_argument(
-        'input_handles', metavar='INPUT', type=FileType('r'), nargs='*',
+        'input_handles', metavar='INPUT',
+        type=FileType('r', bufsize=_INPUT_BUFFER_SIZE), nargs='*',
         default=[sys.stdin], help='input file (default: stdin)')
 
     input_profile_parser = argparse.ArgumentParser(add_help=False)
@@ -869,6 +905,10 @@ def main(args=None):
         help='make a k-mer profile per FASTA record instead of a k-mer '
         'profile per FASTA file (profiles are named by the record names and '
         ' prefixed according to --profiles if more than one INPUT is given)')
+    parser_count.add_argument(
+        '--merge', '-m', dest='merge', action='store_true',
+        help='make one k-mer profile from all INPUT files instead of a k-mer '
+        'profile per INPUT file (default name: 1)')
     parser_count.set_defaults(func=count)
 
     parser_merge = subparsers.add_parser(
@@ -961,6 +1001,10 @@ def main(args=None):
     parser_matrix = subparsers.add_parser(
         'matrix', parents=[input_profile_parser, output_parser, dist_parser],
         description=doc_split(distance_matrix))
+    parser_matrix.add_argument(
+        '-j', '--jobs', dest='jobs', metavar='INT', type=int, default=1,
+        help='number of processes to calculate the distances with (default: '
+        '%(default)s)')
     parser_matrix.set_defaults(func=distance_matrix)
 
     try:
@@ -11,12 +11,13 @@ General library containing metrics and helper functions.
 
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
-from future import standard_library
 
 import numpy as np
 
-with standard_library.hooks():
-    from collections import Counter
+try:
+    import numba
+except ImportError:
+    numba = None
 
 
 def distribution(vector):
@@ -30,7 +31,22 @@ def distribution(vector):
     :rtype: list(int, int)
     """
     # Todo: I'm not sure this should be in this module.
-    return sorted(Counter(vector).items())
+    vector = np.asanyarray(vector)
+
+    if not vector.size:
+        return []
+
+    # Counting directly in an array of bins is fastest, but only if the
+    # values are small enough to not make that array huge.
+    if (vector.dtype.kind in 'iu' and vector.min() >= 0 and
+            vector.max() <= vector.size):
+        counts = np.bincount(vector)
+        values = np.flatnonzero(counts)
+        counts = counts[values]
+    else:
+        values, counts = np.unique(vector, return_counts=True)
+
+    return list(zip(values.tolist(), counts.tolist()))
 
 
 def vector_length(vector):
@@ -53,6 +69,20 @@ def get_scale(left, right):
 
     :arg array_like left, right: A vector.
 
+    :return: A tuple of scaling factors.
+    :rtype: float, float
+    """
+    return get_scale_from_totals(np.sum(left), np.sum(right))
+
+
+def get_scale_from_totals(left_total, right_total):
+    """
+    Calculate scaling factors based upon precomputed total counts. See
+    :func:`get_scale`.
+
+    :arg left_total, right_total: Sum of the counts in a vector.
+    :type left_total, right_total: int or float
+
     :return: A tuple of scaling factors.
     :rtype: float, float
     """
@@ -61,13 +91,10 @@ def get_scale(left, right):
 
     # Calculate the scaling factors in such a way that no element is
     # between 0 and 1.
-    left_sum = np.sum(left)
-    right_sum = np.sum(right)
-
-    if left_sum < right_sum:
-        left_scale = right_sum / left_sum
+    if left_total < right_total:
+        left_scale = right_total / left_total
     else:
-        right_scale = left_sum / right_sum
+        right_scale = left_total / right_total
 
     return left_scale, right_scale
 
@@ -118,6 +145,12 @@ def multiset(left, right, pairwise):
     left = np.asanyarray(left)
     right = np.asanyarray(right)
 
+    kernel = _multiset_kernels.get(pairwise)
+    if (kernel is not None and left.ndim == 1 and
+            left.shape == right.shape and left.dtype.kind in 'if' and
+            right.dtype.kind in 'if'):
+        return kernel(left, right)
+
     nonzero = np.where(np.logical_or(left, right))
     distances = pairwise(left[nonzero], right[nonzero])
     return distances.sum() / (len(distances) + 1)
@@ -155,13 +188,70 @@ vector_distance = {
 }
 
 
+def _pairwise_prod(x, y):
+    """
+    Absolute difference, normalised by the product of the values (plus one).
+    """
+    return abs(x - y) / ((x + 1) * (y + 1))
+
+
+def _pairwise_sum(x, y):
+    """
+    Absolute difference, normalised by the sum of the values (plus one).
+    """
+    return abs(x - y) / (x + y + 1)
+
+
 #: Pairwise distance functions. Arguments should be of type `numpy.ndarray`.
+#: They are module level functions (not lambdas), so they can be pickled for
+#: worker processes.
 pairwise = {
-    "prod": lambda x, y: abs(x - y) / ((x + 1) * (y + 1)),
-    "sum": lambda x, y: abs(x - y) / (x + y + 1)
+    "prod": _pairwise_prod,
+    "sum": _pairwise_sum
 }
 
 
+if numba is not None:
+    try:
+        # Compiled versions of :func:`multiset` with the predefined pairwise
+        # distance functions. They do a single pass over both vectors instead
+        # of creating a temporary array for every step of the calculation.
+        @numba.njit(cache=True)
+        def _multiset_prod(left, right):
+            total = 0.0
+            count = 0
+            for i in range(left.shape[0]):
+                x = left[i]
+                y = right[i]
+                if x or y:
+                    total += abs(x - y) / ((x + 1) * (y + 1))
+                    count += 1
+            return total / (count + 1)
+
+        @numba.njit(cache=True)
+        def _multiset_sum(left, right):
+            total = 0.0
+            count = 0
+            for i in range(left.shape[0]):
+                x = left[i]
+                y = right[i]
+                if x or y:
+                    total += abs(x - y) / (x + y + 1)
+                    count += 1
+            return total / (count + 1)
+    except RuntimeError:
+        # Numba cannot cache compiled functions if it finds no writable
+        # cache directory, in which case we use the NumPy implementation.
+        _multiset_kernels = {}
+    else:
+        _multiset_kernels = {
+            pairwise['prod']: _multiset_prod,
+            pairwise['sum']: _multiset_sum
+        }
+else:
+    _multiset_kernels = {}
+
+
 #: Summary functions.
 summary = {
     "min": np.min,
@@ -8,8 +8,10 @@ from __future__ import (absolute_import, division, print_function,
 from future import standard_library
 
 from io import StringIO
+import sys
 
 import numpy as np
+import pytest
 
 from kpal import kdistlib, klib, metrics
 
@@ -73,6 +75,123 @@ class TestKDistLib(object):
 
         assert out.getvalue().strip().split('\n') == ['3', 'a', 'b', 'c', '0.46', '0.00 0.46']
 
+    def test_distance_matrix_duplicates(self):
+        counts_left = utils.counts(utils.SEQUENCES_LEFT, 8)
+        counts_right = utils.counts(utils.SEQUENCES_RIGHT, 8)
+
+        profiles = [klib.Profile(utils.as_array(counts_left, 8), 'a'),
+                    klib.Profile(utils.as_array(counts_right, 8), 'b'),
+                    klib.Profile(utils.as_array(counts_left, 8), 'c'),
+                    klib.Profile(utils.as_array(counts_right, 8), 'd')]
+
+        k_dist = kdistlib.ProfileDistance(pairwise=np.multiply)
+        out = StringIO()
+        kdistlib.distance_matrix(profiles, out, 3, k_dist)
+
+        rows = [' '.join('%.3f' % k_dist.distance(profiles[i], profiles[j])
+                         for j in range(i))
+                for i in range(1, 4)]
+        assert kdistlib._representatives(profiles) == [0, 1, 0, 1]
+        assert out.getvalue().strip().split('\n') == ['4', 'a', 'b', 'c',
+                                                      'd'] + rows
+
+    def test_distance_matrix_scale_balance(self):
+        counts_left = utils.counts(utils.SEQUENCES_LEFT, 8)
+        counts_right = utils.counts(utils.SEQUENCES_RIGHT, 8)
+
+        profiles = [klib.Profile(utils.as_array(counts_left, 8), 'a'),
+                    klib.Profile(utils.as_array(counts_right, 8), 'b')]
+
+        k_dist = kdistlib.ProfileDistance(do_balance=True, do_scale=True)
+        out = StringIO()
+        kdistlib.distance_matrix(profiles, out, 10, k_dist)
+
+        distance = k_dist.distance(profiles[1], profiles[0])
+        assert out.getvalue().strip().split('\n') == ['2', 'a', 'b',
+                                                      '%.10f' % distance]
+        utils.test_profile(profiles[0], counts_left, 8)
+
+    def test_distance_matrix_scale_down(self):
+        counts_left = utils.counts(utils.SEQUENCES_LEFT, 8)
+        counts_right = utils.counts(utils.SEQUENCES_RIGHT, 8)
+
+        profiles = [klib.Profile(utils.as_array(counts_left, 8), 'a'),
+                    klib.Profile(utils.as_array(counts_right, 8), 'b')]
+
+        k_dist = kdistlib.ProfileDistance(do_scale=True, down=True)
+        out = StringIO()
+        kdistlib.distance_matrix(profiles, out, 10, k_dist)
+
+        distance = k_dist.distance(profiles[1], profiles[0])
+        assert out.getvalue().strip().split('\n') == ['2', 'a', 'b',
+                                                      '%.10f' % distance]
+
+    def test_distance_positive(self):
+        a = np.random.randint(0, 4, 256)
+        b = np.random.randint(0, 4, 256)
+
+        k_dist = kdistlib.ProfileDistance(do_positive=True, do_scale=True)
+        left = metrics.positive(a, b)
+        right = metrics.positive(b, a)
+        left_scale, right_scale = metrics.get_scale(left, right)
+        expected = metrics.multiset(left * left_scale, right * right_scale,
+                                    metrics.pairwise['prod'])
+
+        np.testing.assert_almost_equal(
+            k_dist.distance(klib.Profile(a), klib.Profile(b)), expected)
+
+    def test_distance_positive_scale_disjoint(self):
+        a = np.array([1, 0, 2, 0])
+        b = np.array([0, 3, 0, 0])
+
+        for down in False, True:
+            k_dist = kdistlib.ProfileDistance(do_positive=True, do_scale=True,
+                                              down=down)
+            assert np.isnan(k_dist.distance(klib.Profile(a), klib.Profile(b)))
+            assert np.isnan(k_dist.distance(klib.Profile(a),
+                                            klib.Profile(np.zeros(4))))
+
+    def _test_distance_matrix_vector(self, distance_function, counts):
+        profiles = [klib.Profile(utils.as_array(c, 8), name)
+                    for c, name in zip(counts, 'abcd')]
+
+        k_dist = kdistlib.ProfileDistance(
+            do_balance=True, distance_function=distance_function)
+        out = StringIO()
+        kdistlib.distance_matrix(profiles, out, 10, k_dist)
+
+        rows = [' '.join('%.10f' % k_dist.distance(profiles[i], profiles[j])
+                         for j in range(i))
+                for i in range(1, len(profiles))]
+        assert out.getvalue().strip().split('\n')[len(profiles) + 1:] == rows
+
+    def test_distance_matrix_euclidean(self):
+        counts = [utils.counts(utils.SEQUENCES_LEFT, 8),
+                  utils.counts(utils.SEQUENCES_RIGHT, 8),
+                  utils.counts(utils.SEQUENCES_LEFT, 8)]
+        self._test_distance_matrix_vector(metrics.euclidean, counts)
+
+    def test_distance_matrix_cosine(self):
+        counts = [utils.counts(utils.SEQUENCES_LEFT, 8),
+                  utils.counts(utils.SEQUENCES_RIGHT, 8),
+                  utils.counts(utils.SEQUENCES_LEFT, 8)]
+        self._test_distance_matrix_vector(metrics.cosine_similarity, counts)
+
+    def test_distance_matrix_euclidean_large(self):
+        counts = [utils.counts(utils.SEQUENCES_LEFT, 8),
+                  utils.counts(utils.SEQUENCES_RIGHT, 8)]
+        counts[0]['ACGTACGT'] = 2 ** 30
+        self._test_distance_matrix_vector(metrics.euclidean, counts)
+
+    def test_distance_matrix_vector_blocks(self, monkeypatch):
+        monkeypatch.setattr(klib, '_MATRIX_BLOCK_SIZE', 5)
+        counts = [utils.counts(utils.SEQUENCES_LEFT, 8),
+                  utils.counts(utils.SEQUENCES_RIGHT, 8),
+                  utils.counts(utils.SEQUENCES_LEFT, 8),
+                  utils.counts(utils.SEQUENCES_RIGHT, 8)]
+        self._test_distance_matrix_vector(metrics.euclidean, counts)
+        self._test_distance_matrix_vector(metrics.cosine_similarity, counts)
+
     def test_ProfileDistance_dynamic_smooth(self):
         # If we use function=min and threshold=0, we should get the following
         # transformation:
@@ -133,3 +252,26 @@ class TestKDistLib(object):
 
         utils.test_profile(profile_a, counts_a, 8)
         utils.test_profile(profile_b, counts_b, 8)
+
+    def test_distance_matrix_jobs(self):
+        counts = [utils.counts(s, 4) for s in utils.SEQUENCES]
+        profiles = [klib.Profile(utils.as_array(c, 4), name=n)
+                    for c, n in zip(counts + counts, 'abcd')]
+
+        k_dist = kdistlib.ProfileDistance(do_balance=True, do_scale=True)
+        output = StringIO()
+        kdistlib.distance_matrix(profiles, output, 2, k_dist, jobs=2)
+        expected = StringIO()
+        kdistlib.distance_matrix(profiles, expected, 2, k_dist)
+
+        assert output.getvalue() == expected.getvalue()
+
+    def test_distance_matrix_jobs_no_fork(self, monkeypatch):
+        monkeypatch.setattr(sys, 'platform', 'darwin')
+        counts = [utils.counts(s, 4) for s in utils.SEQUENCES]
+        profiles = [klib.Profile(utils.as_array(c, 4), name=n)
+                    for c, n in zip(counts + counts, 'abc')]
+
+        k_dist = kdistlib.ProfileDistance(pairwise=lambda x, y: x * y)
+        with pytest.raises(ValueError):
+            kdistlib.distance_matrix(profiles, StringIO(), 2, k_dist, jobs=2)
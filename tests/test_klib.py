@@ -8,7 +8,6 @@ from __future__ import (absolute_import, division, print_function,
 from future.builtins import range, str, zip
 
 from io import open
-import itertools
 
 import numpy as np
 import pytest
@@ -17,11 +16,6 @@ from kpal import klib
 
 import utils
 
-try:
-    from collections import Counter
-except ImportError:
-    from counter import Counter
-
 
 class TestKlib(utils.TestEnvironment):
     def test_profile(self):
@@ -80,6 +74,36 @@ class TestKlib(utils.TestEnvironment):
     def test_from_fasta_multi_n_almost_strlen(self):
         self._test_from_fasta(utils.LENGTH_8_WITH_N, 7)
 
+    def test_from_sequences_numba(self):
+        pytest.importorskip('numba')
+        counts = utils.counts(utils.SEQUENCES_WITH_N, 8)
+        profile = klib.Profile.from_sequences(utils.SEQUENCES_WITH_N, 8)
+        utils.test_profile(profile, counts, 8)
+
+    def test_from_sequences_numba_no_cache(self, monkeypatch):
+        caching = pytest.importorskip('numba.core.caching')
+        monkeypatch.setattr(caching.CacheImpl, '_locator_classes', [])
+        copy = utils.import_copy(klib)
+        assert copy._count_kmers is None
+
+        counts = utils.counts(utils.SEQUENCES_WITH_N, 8)
+        profile = copy.Profile.from_sequences(utils.SEQUENCES_WITH_N, 8)
+        utils.test_profile(profile, counts, 8)
+
+    def test_from_sequences_blocks(self, monkeypatch):
+        monkeypatch.setattr(klib, '_count_kmers', None)
+        monkeypatch.setattr(klib, '_BLOCK_SIZE', 7)
+        monkeypatch.setattr(klib, '_BATCH_SIZE', 5)
+        counts = utils.counts(utils.SEQUENCES_WITH_N, 4)
+        profile = klib.Profile.from_sequences(utils.SEQUENCES_WITH_N, 4)
+        utils.test_profile(profile, counts, 4)
+
+    def test_from_sequences_non_ascii(self):
+        counts = utils.counts(['ACGTA', 'CGT', 'TGCA', 'TGCA'], 3)
+        profile = klib.Profile.from_sequences(['ACGTA\u00e9CGT',
+                                               'TGCA\u00e9TGCA'], 3)
+        utils.test_profile(profile, counts, 3)
+
     def test_from_fasta_single_name(self):
         self._test_from_fasta(utils.SEQUENCES[:1], 4, name='abc')
 
@@ -108,6 +132,36 @@ class TestKlib(utils.TestEnvironment):
 
         utils.test_profile_file(filename, counts, 4)
 
+    def test_profile_save_int32(self):
+        counts = utils.counts(utils.SEQUENCES, 4)
+        profile = klib.Profile(utils.as_array(counts, 4))
+
+        filename = self.empty()
+        with utils.open_profile(filename, 'w') as profile_handle:
+            profile.save(profile_handle, name='a')
+
+        with utils.open_profile(filename, 'r') as profile_handle:
+            assert profile_handle['profiles/a'].dtype == np.int32
+            profile = klib.Profile.from_file(profile_handle)
+
+        assert profile.counts.dtype == np.int64
+        utils.test_profile(profile, counts, 4)
+
+    def test_profile_save_int64(self):
+        counts = utils.counts(utils.SEQUENCES, 4)
+        counts['AAAA'] = 2 ** 40
+        profile = klib.Profile(utils.as_array(counts, 4))
+
+        filename = self.empty()
+        with utils.open_profile(filename, 'w') as profile_handle:
+            profile.save(profile_handle, name='a')
+
+        with utils.open_profile(filename, 'r') as profile_handle:
+            assert profile_handle['profiles/a'].dtype == np.int64
+            profile = klib.Profile.from_file(profile_handle)
+
+        utils.test_profile(profile, counts, 4)
+
     def test_profile_name_with_slash(self):
         counts = utils.counts(utils.SEQUENCES, 4)
         with pytest.raises(ValueError):
@@ -120,6 +174,18 @@ class TestKlib(utils.TestEnvironment):
 
         utils.test_profile(profile, counts, 4)
 
+    def test_profile_from_file_old_format_truncated(self):
+        counts = utils.counts(utils.SEQUENCES, 4)
+        filename = self.profile_old_format(counts, 4)
+        with open(filename) as handle:
+            content = handle.read()
+        with open(filename, 'w') as handle:
+            handle.write(content[:len(content) // 2])
+
+        with open(filename) as handle:
+            with pytest.raises(ValueError):
+                klib.Profile.from_file_old_format(handle)
+
     def test_profile_from_file(self):
         counts = utils.counts(utils.SEQUENCES, 4)
         with utils.open_profile(self.profile(counts, 4), 'r') as profile_handle:
@@ -127,6 +193,15 @@ class TestKlib(utils.TestEnvironment):
 
         utils.test_profile(profile, counts, 4)
 
+    def test_profile_from_file_out(self):
+        counts = utils.counts(utils.SEQUENCES, 4)
+        out = np.zeros(4 ** 4, dtype='int64')
+        with utils.open_profile(self.profile(counts, 4), 'r') as profile_handle:
+            profile = klib.Profile.from_file(profile_handle, out=out)
+
+        utils.test_profile(profile, counts, 4)
+        assert profile.counts is out
+
     def test_profile_from_file_save(self):
         counts = utils.counts(utils.SEQUENCES, 4)
         with utils.open_profile(self.profile(counts, 4), 'r') as profile_handle:
@@ -179,6 +254,14 @@ class TestKlib(utils.TestEnvironment):
                            for s, c in counts.items()))
         utils.test_profile(profile, counts, 4)
 
+    def test_profile_reverse_complements(self):
+        counts = utils.counts(utils.SEQUENCES, 4)
+        profile = klib.Profile(utils.as_array(counts, 4))
+
+        np.testing.assert_array_equal(
+            profile._reverse_complements(),
+            [profile.reverse_complement(i) for i in range(4 ** 4)])
+
     def _test_profile_split(self, sequences, length):
         counts = utils.counts(sequences, length)
         profile = klib.Profile(utils.as_array(counts, length))
@@ -237,9 +320,7 @@ class TestKlib(utils.TestEnvironment):
         profile = klib.Profile(utils.as_array(counts, 8))
         profile.shrink(1)
 
-        counts = Counter(dict((t, sum(counts[u] for u in counts
-                                            if u.startswith(t)))
-                                    for t in set(s[:-1] for s in counts)))
+        counts = utils.shrink(counts, 1)
         utils.test_profile(profile, counts, 7)
 
     def test_profile_shrink_two(self):
@@ -247,9 +328,7 @@ class TestKlib(utils.TestEnvironment):
         profile = klib.Profile(utils.as_array(counts, 8))
         profile.shrink(2)
 
-        counts = Counter(dict((t, sum(counts[u] for u in counts
-                                            if u.startswith(t)))
-                                    for t in set(s[:-2] for s in counts)))
+        counts = utils.shrink(counts, 2)
         utils.test_profile(profile, counts, 6)
 
     def test_profile_shrink_three(self):
@@ -257,9 +336,7 @@ class TestKlib(utils.TestEnvironment):
         profile = klib.Profile(utils.as_array(counts, 8))
         profile.shrink(3)
 
-        counts = Counter(dict((t, sum(counts[u] for u in counts
-                                            if u.startswith(t)))
-                                    for t in set(s[:-3] for s in counts)))
+        counts = utils.shrink(counts, 3)
         utils.test_profile(profile, counts, 5)
 
     def test_profile_shrink_max(self):
@@ -267,9 +344,7 @@ class TestKlib(utils.TestEnvironment):
         profile = klib.Profile(utils.as_array(counts, 4))
         profile.shrink(3)
 
-        counts = Counter(dict((t, sum(counts[u] for u in counts
-                                            if u.startswith(t)))
-                                    for t in set(s[:-3] for s in counts)))
+        counts = utils.shrink(counts, 3)
         utils.test_profile(profile, counts, 1)
 
     def test_profile_shrink_invalid(self):
@@ -282,10 +357,10 @@ class TestKlib(utils.TestEnvironment):
         counts = utils.counts(utils.SEQUENCES, 2)
         profile = klib.Profile(utils.as_array(counts, 2))
 
-        np.random.seed(100)
-        profile.shuffle()
+        with utils.random_seed(100):
+            profile.shuffle()
 
-        counts = dict(zip([''.join(s) for s in itertools.product('ACGT', repeat=2)],
+        counts = dict(zip(utils.kmers(2),
                           [13,  7,  6, 18, 12,  1, 13, 17, 16, 12, 23, 27, 24, 17, 18, 12]))
         utils.test_profile(profile, counts, 2)
 
@@ -293,45 +368,53 @@ class TestKlib(utils.TestEnvironment):
         counts = utils.counts(utils.SEQUENCES, 4)
         profile = klib.Profile(utils.as_array(counts, 4))
 
-        for i, s in enumerate(itertools.product('ACGT', repeat=4)):
-            assert i == profile.dna_to_binary(''.join(s))
+        for i, s in enumerate(utils.kmers(4)):
+            assert i == profile.dna_to_binary(s)
+
+    def test_profile_dna_to_binary_invalid(self):
+        counts = utils.counts(utils.SEQUENCES, 4)
+        profile = klib.Profile(utils.as_array(counts, 4))
+
+        for word in 'ACGN', 'AC12', 'AC G':
+            with pytest.raises(KeyError):
+                profile.dna_to_binary(word)
 
     def test_profile_binary_to_dna(self):
         counts = utils.counts(utils.SEQUENCES, 4)
         profile = klib.Profile(utils.as_array(counts, 4))
 
-        for i, s in enumerate(itertools.product('ACGT', repeat=4)):
-            assert ''.join(s) == profile.binary_to_dna(i)
+        for i, s in enumerate(utils.kmers(4)):
+            assert s == profile.binary_to_dna(i)
 
-    def test_profile_ratios_matrix(self):
+    def test_profile_ratios_matrix(self, monkeypatch):
+        # Fill the matrix in several blocks of rows.
+        monkeypatch.setattr(klib, '_MATRIX_BLOCK_SIZE', 1000)
         counts = utils.counts(utils.SEQUENCES, 4)
         profile = klib.Profile(utils.as_array(counts, 4))
 
         ratios = profile._ratios_matrix()
         total = sum(counts.values())
 
-        for left in itertools.product('ACGT', repeat=4):
-            for right in itertools.product('ACGT', repeat=4):
-                left = ''.join(left)
-                right = ''.join(right)
-                ratio = ratios[utils.count_index(left)][utils.count_index(right)]
+        for i, left in enumerate(utils.kmers(4)):
+            for j, right in enumerate(utils.kmers(4)):
+                ratio = ratios[i][j]
                 try:
                     assert ratio == counts[left] / counts[right] / total
                 except ZeroDivisionError:
                     assert ratio == -1.0
 
-    def test_profile_freq_diff_matrix(self):
+    def test_profile_freq_diff_matrix(self, monkeypatch):
+        # Fill the matrix in several blocks of rows.
+        monkeypatch.setattr(klib, '_MATRIX_BLOCK_SIZE', 1000)
         counts = utils.counts(utils.SEQUENCES, 4)
         profile = klib.Profile(utils.as_array(counts, 4))
         freq_diffs = profile._freq_diff_matrix()
 
         total = sum(counts.values())
 
-        for left in itertools.product('ACGT', repeat=4):
-            for right in itertools.product('ACGT', repeat=4):
-                left = ''.join(left)
-                right = ''.join(right)
-                freq_diff = freq_diffs[utils.count_index(left)][utils.count_index(right)]
+        for i, left in enumerate(utils.kmers(4)):
+            for j, right in enumerate(utils.kmers(4)):
+                freq_diff = freq_diffs[i][j]
                 if counts[right] > 0:
                     assert freq_diff == abs(counts[left] - counts[right]) / total
                 else:
@@ -343,5 +426,5 @@ class TestKlib(utils.TestEnvironment):
         profile.print_counts()
 
         out, err = capsys.readouterr()
-        assert out == ''.join('%s %d\n' % (''.join(s), counts[''.join(s)])
-                              for s in itertools.product('ACGT', repeat=4))
+        assert out == ''.join('%s %d\n' % (s, counts[s])
+                              for s in utils.kmers(4))
@@ -8,14 +8,11 @@ from __future__ import (absolute_import, division, print_function,
 from future import standard_library
 from future.builtins import str, zip
 
-
-import itertools
 from io import open, StringIO
 
-from Bio import Seq
 import numpy as np
 
-from kpal import kmer
+from kpal import klib, kmer
 
 import utils
 
@@ -24,6 +21,24 @@ with standard_library.hooks():
 
 
 class TestKmer(utils.TestEnvironment):
+    def _info(self, counts, k, name):
+        """
+        Expected output of `kmer.info` for a profile with `counts`.
+        """
+        values = utils.as_array(counts, k)
+
+        expected = 'File format version: 1.0.0\n'
+        expected += 'Produced by: kMer unit tests\n\n'
+        expected += 'Profile: %s\n' % name
+        expected += '- k-mer length: %d (%d k-mers)\n' % (k, 4**k)
+        expected += '- Zero counts: %i\n' % (4**k - len(counts))
+        expected += '- Non-zero counts: %i\n' % len(counts)
+        expected += '- Sum of counts: %i\n' % sum(counts.values())
+        expected += '- Mean of counts: %.3f\n' % np.mean(values)
+        expected += '- Median of counts: %.3f\n' % np.median(values)
+        expected += '- Standard deviation of counts: %.3f\n' % np.std(values)
+        return expected
+
     def test_main_info(self, capsys):
         # For the `capsys` fixture, see:
         # http://pytest.org/latest/capture.html
@@ -35,16 +50,7 @@ class TestKmer(utils.TestEnvironment):
 
         out, err = capsys.readouterr()
 
-        expected = 'File format version: 1.0.0\n'
-        expected += 'Produced by: kMer unit tests\n\n'
-        expected += 'Profile: a\n'
-        expected += '- k-mer length: 8 (%d k-mers)\n' % (4**8)
-        expected += '- Zero counts: %i\n' % (4**8 - len(counts))
-        expected += '- Non-zero counts: %i\n' % len(counts)
-        expected += '- Sum of counts: %i\n' % sum(counts.values())
-        expected += '- Mean of counts: %.3f\n' % np.mean([0] * (4**8 - len(counts)) + list(counts.values()))
-        expected += '- Median of counts: %.3f\n' % np.median([0] * (4**8 - len(counts)) + list(counts.values()))
-        expected += '- Standard deviation of counts: %.3f\n' % np.std([0] * (4**8 - len(counts)) + list(counts.values()))
+        expected = self._info(counts, 8, 'a')
 
         assert out == expected
 
@@ -99,6 +105,15 @@ class TestKmer(utils.TestEnvironment):
         utils.test_profile_file(filename, counts_left, 8, name='a')
         utils.test_profile_file(filename, counts_right, 8, name='b')
 
+    def test_count_multi_merge(self):
+        counts = utils.counts(utils.SEQUENCES_LEFT + utils.SEQUENCES_RIGHT, 8)
+        filename = self.empty()
+        with open(self.fasta(utils.SEQUENCES_LEFT)) as handle_left:
+            with open(self.fasta(utils.SEQUENCES_RIGHT)) as handle_right:
+                with utils.open_profile(filename, 'w') as profile_handle:
+                    kmer.count([handle_left, handle_right], profile_handle, 8, names=['a'], merge=True)
+        utils.test_profile_file(filename, counts, 8, name='a')
+
     def test_count_by_record(self):
         counts_by_record = [utils.counts(record, 8) for record in utils.SEQUENCES]
         names = [str(i) for i, _ in enumerate(counts_by_record)]
@@ -208,10 +223,11 @@ class TestKmer(utils.TestEnvironment):
         with utils.open_profile(self.profile(counts, 8)) as input_handle:
             kmer.get_stats(input_handle, out)
 
+        values = utils.as_array(counts, 8)
         name, mean, std = out.getvalue().strip().split()
         assert name == '1'
-        assert mean == '%.10f' % np.mean(utils.as_array(counts, 8))
-        assert std == '%.10f' % np.std(utils.as_array(counts, 8))
+        assert mean == '%.10f' % np.mean(values)
+        assert std == '%.10f' % np.std(values)
 
     def test_distribution(self):
         counts = utils.counts(utils.SEQUENCES, 8)
@@ -220,7 +236,9 @@ class TestKmer(utils.TestEnvironment):
         with utils.open_profile(self.profile(counts, 8)) as input_handle:
             kmer.distribution(input_handle, out)
 
-        counter = Counter(utils.as_array(counts, 8))
+        # All k-mers not in the reference counts have count zero.
+        counter = Counter(counts.values())
+        counter[0] = 4 ** 8 - len(counts)
         assert out.getvalue() == '\n'.join('1 %i %i' % x
                                            for x in sorted(counter.items())) + '\n'
 
@@ -231,19 +249,26 @@ class TestKmer(utils.TestEnvironment):
         with utils.open_profile(self.profile(counts, 8, 'a')) as input_handle:
             kmer.info(input_handle, out)
 
-        expected = 'File format version: 1.0.0\n'
-        expected += 'Produced by: kMer unit tests\n\n'
-        expected += 'Profile: a\n'
-        expected += '- k-mer length: 8 (%d k-mers)\n' % (4**8)
-        expected += '- Zero counts: %i\n' % (4**8 - len(counts))
-        expected += '- Non-zero counts: %i\n' % len(counts)
-        expected += '- Sum of counts: %i\n' % sum(counts.values())
-        expected += '- Mean of counts: %.3f\n' % np.mean([0] * (4**8 - len(counts)) + list(counts.values()))
-        expected += '- Median of counts: %.3f\n' % np.median([0] * (4**8 - len(counts)) + list(counts.values()))
-        expected += '- Standard deviation of counts: %.3f\n' % np.std([0] * (4**8 - len(counts)) + list(counts.values()))
+        expected = self._info(counts, 8, 'a')
 
         assert out.getvalue() == expected
 
+    def test_info_saved(self):
+        counts = utils.counts(utils.SEQUENCES, 8)
+        filename = self.empty()
+        with utils.open_profile(filename, 'w') as handle:
+            klib.Profile(utils.as_array(counts, 8), name='a').save(handle)
+        out = StringIO()
+        expected = StringIO()
+
+        with utils.open_profile(filename) as input_handle:
+            kmer.info(input_handle, out)
+        with utils.open_profile(self.profile(counts, 8, 'a')) as input_handle:
+            kmer.info(input_handle, expected)
+
+        assert (out.getvalue().split('\n')[2:] ==
+                expected.getvalue().split('\n')[2:])
+
     def test_get_count(self):
         counts = utils.counts(utils.SEQUENCES, 8)
         word, count = counts.most_common(1)[0]
@@ -266,10 +291,10 @@ class TestKmer(utils.TestEnvironment):
                     with utils.open_profile(filename_right, 'w') as out_right:
                         kmer.positive(handle_left, handle_right, out_left, out_right)
 
-        utils.test_profile_file(filename_left, Counter(s for s in counts_left.elements()
-                                                             if s in counts_right), 8)
-        utils.test_profile_file(filename_right, Counter(s for s in counts_right.elements()
-                                                              if s in counts_left), 8)
+        utils.test_profile_file(filename_left, Counter(dict((s, c) for s, c in counts_left.items()
+                                                            if s in counts_right)), 8)
+        utils.test_profile_file(filename_right, Counter(dict((s, c) for s, c in counts_right.items()
+                                                             if s in counts_left)), 8)
 
     def test_scale(self):
         counts_left = utils.counts(utils.SEQUENCES_LEFT, 8)
@@ -283,12 +308,15 @@ class TestKmer(utils.TestEnvironment):
                     with utils.open_profile(filename_right, 'w') as out_right:
                         kmer.scale(handle_left, handle_right, out_left, out_right)
 
-        if sum(counts_left.values()) < sum(counts_right.values()):
-            scale_left = sum(counts_right.values()) / sum(counts_left.values())
+        total_left = sum(counts_left.values())
+        total_right = sum(counts_right.values())
+
+        if total_left < total_right:
+            scale_left = total_right / total_left
             scale_right = 1.0
         else:
             scale_left = 1.0
-            scale_right = sum(counts_left.values()) / sum(counts_right.values())
+            scale_right = total_left / total_right
 
         for s in counts_left:
             counts_left[s] *= scale_left
@@ -306,9 +334,7 @@ class TestKmer(utils.TestEnvironment):
             with utils.open_profile(filename, 'w') as output_handle:
                 kmer.shrink(input_handle, output_handle, 1)
 
-        counts = Counter(dict((t, sum(counts[u] for u in counts
-                                            if u.startswith(t)))
-                                    for t in set(s[:-1] for s in counts)))
+        counts = utils.shrink(counts, 1)
         utils.test_profile_file(filename, counts, 7)
 
     def test_shuffle(self):
@@ -318,10 +344,10 @@ class TestKmer(utils.TestEnvironment):
 
         with utils.open_profile(self.profile(counts, 2)) as input_handle:
             with utils.open_profile(filename, 'w') as output_handle:
-                np.random.seed(100)
-                kmer.shuffle(input_handle, output_handle)
+                with utils.random_seed(100):
+                    kmer.shuffle(input_handle, output_handle)
 
-        counts = dict(zip([''.join(s) for s in itertools.product('ACGT', repeat=2)],
+        counts = dict(zip(utils.kmers(2),
                           [13,  7,  6, 18, 12,  1, 13, 17, 16, 12, 23, 27, 24, 17, 18, 12]))
         utils.test_profile_file(filename, counts, 2)
 
@@ -540,6 +566,20 @@ class TestKmer(utils.TestEnvironment):
 
         assert out.getvalue().strip().split('\n') == ['3', 'a', 'b', 'c', '0.001', '0.000 0.001']
 
+    def test_distance_matrix_jobs(self):
+        counts_left = utils.counts(utils.SEQUENCES_LEFT, 8)
+        counts_right = utils.counts(utils.SEQUENCES_RIGHT, 8)
+        out = StringIO()
+
+        with utils.open_profile(self.multi_profile(8,
+                                                   [counts_left,
+                                                    counts_right,
+                                                    counts_left],
+                                                   ['a', 'b', 'c'])) as handle:
+            kmer.distance_matrix(handle, out, precision=3, jobs=2)
+
+        assert out.getvalue().strip().split('\n') == ['3', 'a', 'b', 'c', '0.463', '0.000 0.463']
+
     def test_distance_matrix_pairwise_name(self):
         counts_left = utils.counts(utils.SEQUENCES_LEFT, 8)
         counts_right = utils.counts(utils.SEQUENCES_RIGHT, 8)
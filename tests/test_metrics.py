@@ -11,6 +11,7 @@ from future.builtins import zip
 import math
 
 import numpy as np
+import pytest
 
 from kpal import metrics
 
@@ -26,6 +27,14 @@ class TestMetrics(object):
         counts = Counter(a)
         assert metrics.distribution(a) == sorted(counts.items())
 
+    def test_distribution_large_values(self):
+        a = np.random.randint(0, 21, 100) * 1000
+        counts = Counter(a)
+        assert metrics.distribution(a) == sorted(counts.items())
+
+    def test_distribution_empty(self):
+        assert metrics.distribution([]) == []
+
     def test_vector_length_float(self):
         a = np.random.rand(100)
         np.testing.assert_almost_equal(metrics.vector_length(a),
@@ -49,6 +58,13 @@ class TestMetrics(object):
             assert scale_a == 1.0
             assert scale_b == a.sum() / b.sum()
 
+    def test_get_scale_from_totals(self):
+        a = np.random.randint(0, 101, 100)
+        b = np.random.randint(0, 101, 100)
+
+        assert (metrics.get_scale_from_totals(a.sum(), b.sum()) ==
+                metrics.get_scale(a, b))
+
     def test_scale_down(self):
         a = 1.0
         b = 1.0 + np.random.random()
@@ -94,6 +110,42 @@ class TestMetrics(object):
         np.testing.assert_almost_equal(metrics.multiset(a, b, pairwise),
                                        sum(values) / (len(values) + 1))
 
+    def test_multiset_numba(self):
+        pytest.importorskip('numba')
+        if not metrics._multiset_kernels:
+            pytest.skip('Numba kernels not available (no cache directory)')
+        a = np.random.randint(0, 21, 100)
+        b = np.random.randint(0, 21, 100) * 1.5
+
+        for name in 'prod', 'sum':
+            pairwise = metrics.pairwise[name]
+            kernel = metrics._multiset_kernels[pairwise]
+
+            values = [pairwise(i, j) for i, j in zip(a, b) if i or j]
+            np.testing.assert_almost_equal(kernel(a, b),
+                                           sum(values) / (len(values) + 1))
+
+    def test_multiset_numba_no_cache(self, monkeypatch):
+        caching = pytest.importorskip('numba.core.caching')
+        monkeypatch.setattr(caching.CacheImpl, '_locator_classes', [])
+        a = np.random.randint(0, 21, 100)
+        b = np.random.randint(0, 21, 100)
+
+        copy = utils.import_copy(metrics)
+        assert copy._multiset_kernels == {}
+        np.testing.assert_almost_equal(
+            copy.multiset(a, b, copy.pairwise['prod']),
+            metrics.multiset(a, b, metrics.pairwise['prod']))
+
+    def test_multiset_custom(self):
+        a = np.random.randint(0, 21, 100)
+        b = np.random.randint(0, 21, 100)
+        pairwise = lambda x, y: abs(x - y) / ((x + 1) * (y + 1))
+
+        np.testing.assert_almost_equal(
+            metrics.multiset(a, b, pairwise),
+            metrics.multiset(a, b, metrics.pairwise['prod']))
+
     def test_euclidean(self):
         a = np.random.randint(1, 101, 100)
         b = np.random.randint(1, 101, 100)
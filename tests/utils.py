@@ -8,6 +8,7 @@ from __future__ import (absolute_import, division, print_function,
 from future.builtins import range, str, zip
 from future import standard_library
 
+from contextlib import contextmanager
 from io import open
 import itertools
 import os
@@ -59,12 +60,15 @@ SEQUENCES_WITH_N = LENGTH_60_WITH_N
 SEQUENCES_SHORT_WITH_N = LENGTH_8_WITH_N
 
 
+# Translation table from nucleotide to its complement.
+_complement = dict(zip([ord(b) for b in u'ACGTacgt'], u'TGCAtgca'))
+
+
 def reverse_complement(sequence):
     """
     Reverse complement of a sequence represented as unicode string.
     """
-    complement = dict(zip([ord(b) for b in u'ACGTacgt'], u'TGCAtgca'))
-    return ''.join(reversed(sequence.translate(complement)))
+    return sequence.translate(_complement)[::-1]
 
 
 def counts(sequence, k):
@@ -91,28 +95,60 @@ def counts(sequence, k):
     return counts
 
 
+# All k-mers in profile order, per k.
+_kmers = {}
+
+_nucleotide_to_binary = {
+    'A': 0x00, 'a': 0x00,
+    'C': 0x01, 'c': 0x01,
+    'G': 0x02, 'g': 0x02,
+    'T': 0x03, 't': 0x03
+}
+
+
+def kmers(k):
+    """
+    List of all k-mers in the order of a kMer profile.
+    """
+    if k not in _kmers:
+        _kmers[k] = [''.join(s) for s in itertools.product('ACGT', repeat=k)]
+    return _kmers[k]
+
+
+def shrink(counts, factor):
+    """
+    Simple k-mer profile shrinking. Returns a dictionary of `k - factor`-mers
+    with the summed counts of all `k`-mers they are a prefix of (implemented
+    as `collections.Counter`).
+
+    To be used as a reference.
+    """
+    shrunk = Counter()
+    for kmer, count in counts.items():
+        shrunk[kmer[:-factor]] += count
+    return shrunk
+
+
 def as_array(counts, k):
     """
-    Convert dictionary of k-mer counts to a list containing the count for
+    Convert dictionary of k-mer counts to an array containing the count for
     every possible k-mer.
     """
-    return np.array([counts[''.join(s)] for s in
-                     itertools.product('ACGT', repeat=k)])
+    # Counts may be scaled to floats, so use the type of the values.
+    values = np.array(list(counts.values()) + [0])
+    array = np.zeros(4 ** k, dtype=values.dtype)
+    for s, c in counts.items():
+        array[count_index(s)] = c
+    return array
 
 
 def count_index(sequence):
     """
     The index of `sequence` in a kMer profile.
     """
-    nucleotide_to_binary = {
-        'A': 0x00, 'a': 0x00,
-        'C': 0x01, 'c': 0x01,
-        'G': 0x02, 'g': 0x02,
-        'T': 0x03, 't': 0x03
-    }
     binary = 0x00
     for b in sequence:
-        binary = ((binary << 2) | nucleotide_to_binary[b])
+        binary = ((binary << 2) | _nucleotide_to_binary[b])
     return binary
 
 
@@ -123,6 +159,34 @@ def count(profile, sequence):
     return profile.counts[count_index(sequence)]
 
 
+@contextmanager
+def random_seed(seed):
+    """
+    Context manager seeding the global NumPy random generator, restoring its
+    previous state afterwards.
+    """
+    state = np.random.get_state()
+    np.random.seed(seed)
+    try:
+        yield
+    finally:
+        np.random.set_state(state)
+
+
+def import_copy(module):
+    """
+    Import a fresh copy of `module`, leaving the module itself untouched. Used
+    to test what happens at import time.
+    """
+    import importlib.util
+
+    spec = importlib.util.spec_from_file_location(module.__name__ + '_copy',
+                                                  module.__file__)
+    copy = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(copy)
+    return copy
+
+
 class open_profile(h5py.File):
     """
     Context manager for an open kMer profile file.
@@ -190,8 +254,8 @@ class TestEnvironment(object):
         filename = self.empty()
 
         with open(filename, 'w') as f:
-            f.write('\n'.join('>' + '\n'.join(entry) for entry in
-                              zip(names, sequences)) + '\n')
+            f.write(''.join('>%s\n%s\n' % entry
+                            for entry in zip(names, sequences)))
 
         return filename
 
@@ -201,8 +265,7 @@ class TestEnvironment(object):
         Filename is returned.
         """
         content = '%d\n%d\n%d\n' % (k, sum(counts.values()), len(counts))
-        content += '\n'.join(str(counts[''.join(s)]) for s in
-                             itertools.product('ACGT', repeat=k)) + '\n'
+        content += '\n'.join(map(str, as_array(counts, k).tolist())) + '\n'
 
         filename = self.empty()
 
@@ -221,7 +284,7 @@ class TestEnvironment(object):
         with open_profile(filename, 'w') as f:
             profile = f.create_dataset(
                 'profiles/%s' % name, dtype='int64', compression='gzip',
-                data=[counts[''.join(s)] for s in itertools.product('ACGT', repeat=k)])
+                data=as_array(counts, k))
             profile.attrs['length'] = k
             profile.attrs['total'] = sum(counts.values())
             profile.attrs['non_zero'] = len(counts)
@@ -241,8 +304,7 @@ class TestEnvironment(object):
             for counts, name in zip(counts_list, names):
                 profile = f.create_dataset(
                     'profiles/%s' % name, dtype='int64', compression='gzip',
-                    data=[counts[''.join(s)]
-                          for s in itertools.product('ACGT', repeat=k)])
+                    data=as_array(counts, k))
                 profile.attrs['length'] = k
                 profile.attrs['total'] = sum(counts.values())
                 profile.attrs['non_zero'] = len(counts)